@@ -1,10 +1,17 @@
 import streamlit as st
 import pandas as pd
 import sqlite3
+import threading
+import pyarrow as pa
 import plotly.express as px
 import plotly.graph_objects as go
+from plotly.subplots import make_subplots
 from pathlib import Path
 from datetime import datetime
+from contextlib import closing
+
+import preparar_banco
+from preparar_banco import ANO_MES_EXPR
 
 # Configuração da página
 st.set_page_config(
@@ -14,103 +21,331 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
-# Variável global para armazenar a conexão
-_conn_cache = None
+# Caminho do banco de dados
+DB_PATH = Path('bolsa_atleta.db')
+
+# Configuração aplicada a cada nova conexão de leitura, executada de uma só
+# vez; mmap e cache maior reduzem syscalls nas consultas com JOIN, e
+# query_only recusa qualquer escrita (liberada só ao gravar os filtros)
+CONNECTION_SETUP_SQL = """
+PRAGMA busy_timeout = 30000;
+PRAGMA synchronous = NORMAL;
+PRAGMA temp_store = MEMORY;
+PRAGMA cache_size = -65536;
+PRAGMA mmap_size = 268435456;
+PRAGMA foreign_keys = ON;
+PRAGMA query_only = ON;
+"""
+
+# Função para preparar o banco de dados
+@st.cache_resource(show_spinner=False)
+def prepare_database():
+    """Cria no banco só o que falta, uma vez por processo, e informa o que está disponível"""
+    # Verificação somente leitura: o arquivo só é aberto para escrita se falta
+    # algum índice, tabela de estatísticas ou o índice de busca. O modo de
+    # journal (WAL) é definido por preparar_banco.py, não pelo app
+    with closing(sqlite3.connect(f"file:{DB_PATH}?mode=ro", uri=True)) as check_conn:
+        pending = preparar_banco.pending_objects(check_conn)
+    if pending:
+        # Com o arquivo somente leitura, as páginas usam as alternativas abaixo
+        try:
+            with closing(sqlite3.connect(str(DB_PATH), timeout=30)) as setup_conn:
+                preparar_banco.prepare(setup_conn)
+        except sqlite3.OperationalError:
+            pass
+        with closing(sqlite3.connect(f"file:{DB_PATH}?mode=ro", uri=True)) as check_conn:
+            pending = preparar_banco.pending_objects(check_conn)
+    
+    # Tabelas _stats_* indisponíveis: a própria consulta de preenchimento
+    # entra como subconsulta no lugar da tabela
+    stats = {name: name if 'stats' not in pending else f"({fill_query})"
+             for name, (_, fill_query) in preparar_banco.STATS_TABLES.items()}
+    # Sem o índice FTS (ausente, desatualizado ou sem suporte) a busca usa LIKE direto
+    return {'fts': 'atleta_fts' not in pending, 'stats': stats}
+
+# Função para obter a fonte das estatísticas de um grupo
+def stats_source(name: str) -> str:
+    """Retorna a tabela _stats_* ou, se ela não está disponível, a subconsulta equivalente"""
+    return prepare_database()['stats'][name]
+
+# Conexões por thread: cada thread de execução do script usa a sua, evitando
+# cursores compartilhados entre sessões. O Streamlit cria uma thread nova a
+# cada rerun, então a conexão dura uma execução do script
+@st.cache_resource(show_spinner=False)
+def get_thread_connections():
+    """Retorna o repositório thread-local das conexões (uma por thread de execução)"""
+    return threading.local()
+
+# Função para fechar a conexão da thread atual
+def close_connection():
+    """Fecha e descarta a conexão da thread atual"""
+    holder = get_thread_connections()
+    conn = getattr(holder, 'conn', None)
+    holder.conn = None
+    if conn is not None:
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
 
 # Função para obter uma conexão válida
 def get_valid_connection():
-    """Retorna uma conexão válida ao banco de dados"""
-    global _conn_cache
-    
-    # Verifica se a conexão existe e está válida
-    if _conn_cache is not None:
-        try:
-            # Testa se a conexão ainda está válida
-            _conn_cache.execute("SELECT 1")
-            return _conn_cache
-        except (sqlite3.ProgrammingError, sqlite3.OperationalError, sqlite3.InterfaceError):
-            # Conexão inválida, fecha e recria
-            try:
-                _conn_cache.close()
-            except:
-                pass
-            _conn_cache = None
+    """Retorna a conexão somente leitura da thread atual, abrindo-a se necessário"""
+    # Conexão já aberta nesta execução: usa sem consultas de verificação;
+    # falhas são tratadas em fetch_query, que reabre a conexão
+    holder = get_thread_connections()
+    conn = getattr(holder, 'conn', None)
+    if conn is not None:
+        return conn
     
     # Cria nova conexão
-    db_path = Path('bolsa_atleta.db')
-    if not db_path.exists():
-        st.error(f"Banco de dados não encontrado: {db_path}")
+    if not DB_PATH.exists():
+        st.error(f"Banco de dados não encontrado: {DB_PATH}")
         st.stop()
     
-    _conn_cache = sqlite3.connect(str(db_path), check_same_thread=False)
-    _conn_cache.execute("PRAGMA busy_timeout = 30000")
-    return _conn_cache
+    prepare_database()
+    conn = sqlite3.connect(f"file:{DB_PATH}?mode=ro", uri=True)
+    conn.executescript(CONNECTION_SETUP_SQL)
+    holder.conn = conn
+    return conn
+
+# Função para materializar o resultado de uma query
+def read_query(conn: sqlite3.Connection, query: str, params=None) -> pd.DataFrame:
+    """Lê o cursor diretamente para um DataFrame, sem a camada SQL do pandas"""
+    cursor = conn.execute(query, params or ())
+    columns = [col[0] for col in cursor.description]
+    return pd.DataFrame.from_records(cursor.fetchall(), columns=columns)
 
-# Função para conectar ao banco de dados (mantida para compatibilidade)
-@st.cache_resource
-def get_db_connection():
-    """Conecta ao banco de dados SQLite"""
-    return get_valid_connection()
+# Função para materializar resultados grandes em colunas Arrow
+def read_arrow_query(conn: sqlite3.Connection, query: str, params=None) -> pd.DataFrame:
+    """Lê o cursor para uma tabela Arrow e retorna um DataFrame com tipos Arrow (sem strings em objetos Python)"""
+    cursor = conn.execute(query, params or ())
+    columns = [col[0] for col in cursor.description]
+    rows = cursor.fetchall()
+    if not rows:
+        return pd.DataFrame.from_records(rows, columns=columns)
+    table = pa.table([pa.array(values) for values in zip(*rows)], names=columns)
+    return table.to_pandas(types_mapper=pd.ArrowDtype)
+
+# Colunas de dimensão que se repetem muito nos resultados, armazenadas como category
+DIMENSION_COLUMNS = ('categoria', 'modalidade', 'uf', 'situacao', 'municipio')
+
+# Tabelas de dimensão pequenas (id -> nome), carregadas uma vez e unidas em pandas
+DIMENSION_TABLES = ('categoria', 'modalidade', 'situacao')
+
+# Fração mínima do valor total para um estado aparecer no treemap
+TREEMAP_MIN_SHARE = 0.0025
+
+# A partir deste número de pontos os gráficos de linha usam WebGL (Scattergl)
+WEBGL_MIN_POINTS = 1000
+
+# Número máximo de pontos enviados ao navegador por série de linha; acima
+# disso a série é reduzida mantendo mínimos e máximos de cada faixa
+DOWNSAMPLE_MAX_POINTS = 2000
+
+# Linhas por página nas tabelas de detalhamento
+TABLE_PAGE_SIZE = 50
+
+# Tamanho mínimo do termo da busca de atletas; termos menores casariam com
+# quase toda a tabela (e não aproveitam o índice trigram)
+BUSCA_MIN_CHARS = 3
+
+# Número máximo de atletas listados pela busca (os de maior valor recebido)
+BUSCA_MAX_RESULTS = 100
+
+# Função para compactar os tipos do DataFrame
+def compact_dtypes(df: pd.DataFrame) -> pd.DataFrame:
+    """Converte dimensões para category e reduz inteiros ao menor tipo possível"""
+    for col in df.columns:
+        if col in DIMENSION_COLUMNS:
+            df[col] = df[col].astype('category')
+        elif pd.api.types.is_integer_dtype(df[col]):
+            df[col] = pd.to_numeric(df[col], downcast='integer')
+    return df
 
 # Função auxiliar para executar queries
-def fetch_query(query: str, conn: sqlite3.Connection = None) -> pd.DataFrame:
-    """Executa uma query SQL e retorna um DataFrame"""
-    # Sempre usa uma conexão válida do cache global
+def fetch_query(query: str, conn: sqlite3.Connection = None, params=None, arrow: bool = False) -> pd.DataFrame:
+    """Executa uma query SQL (opcionalmente parametrizada) e retorna um DataFrame
+    
+    Com arrow=True o resultado usa colunas Arrow, indicado para consultas
+    que retornam muitas linhas.
+    """
+    reader = read_arrow_query if arrow else read_query
+    # Sempre usa a conexão da thread atual
     valid_conn = get_valid_connection()
     
     try:
-        return pd.read_sql_query(query, valid_conn)
-    except (sqlite3.ProgrammingError, sqlite3.OperationalError, sqlite3.InterfaceError) as e:
-        # Se houver erro, limpa o cache e tenta novamente com uma nova conexão
-        global _conn_cache
-        try:
-            if _conn_cache:
-                _conn_cache.close()
-        except:
-            pass
-        _conn_cache = None
+        return compact_dtypes(reader(valid_conn, query, params))
+    except sqlite3.ProgrammingError:
+        # Conexão fechada: limpa o cache e tenta novamente com uma nova conexão
+        close_connection()
         valid_conn = get_valid_connection()
-        return pd.read_sql_query(query, valid_conn)
+        return compact_dtypes(reader(valid_conn, query, params))
+
+# Função para executar queries com cache entre reruns
+@st.cache_data(ttl=600, show_spinner=False)
+def cached_query(query: str, params: tuple = (), filter_sig: tuple = (), arrow: bool = False) -> pd.DataFrame:
+    """Executa uma query via fetch_query, reaproveitando o resultado para a mesma query e parâmetros
+    
+    filter_sig é a assinatura dos filtros globais; entra na chave do cache
+    porque o conteúdo das tabelas temporárias de filtro referenciadas pela
+    query não aparece no texto SQL nem em params.
+    """
+    return fetch_query(query, params=list(params), arrow=arrow)
+
+# Função para carregar as tabelas de dimensão
+@st.cache_resource(show_spinner=False)
+def load_dimensions() -> dict:
+    """Carrega uma única vez as dimensões pequenas como Series id -> nome"""
+    return {table: fetch_query(f"SELECT id_{table}, {table} FROM {table}").set_index(f"id_{table}")[table]
+            for table in DIMENSION_TABLES}
+
+# Função para trocar ids pelos nomes das dimensões
+def attach_dimension(df: pd.DataFrame, *tables: str) -> pd.DataFrame:
+    """Substitui cada coluna id_<tabela> pelo nome da dimensão, na mesma posição"""
+    dims = load_dimensions()
+    for table in tables:
+        id_col = f"id_{table}"
+        names = dims[table]
+        columns = [table if col == id_col else col for col in df.columns]
+        df = df.assign(**{table: df[id_col].map(names).astype(names.dtype)})[columns]
+    return df
+
+# Função para obter as colunas de uma tabela
+@st.cache_data(show_spinner=False)
+def table_columns(table: str) -> list:
+    """Retorna os nomes das colunas da tabela, na ordem do esquema"""
+    return fetch_query("SELECT name FROM pragma_table_info(?) ORDER BY cid", params=[table])['name'].tolist()
+
+# Função para obter o id de um nome de dimensão
+def dimension_id(table: str, name: str) -> int:
+    """Retorna o id correspondente a um nome da dimensão em cache"""
+    names = load_dimensions()[table]
+    return int(names.index[names == name][0])
 
 # Função para obter estatísticas gerais
 @st.cache_data
 def get_statistics(_conn):
     """Retorna estatísticas gerais do banco de dados"""
-    stats = {}
-    
-    # Total de pagamentos
-    stats['total_pagamentos'] = fetch_query('SELECT COUNT(*) as total FROM pagamento', _conn)['total'].iloc[0]
-    
-    # Total de atletas únicos
-    stats['total_atletas'] = fetch_query('SELECT COUNT(DISTINCT cpf) as total FROM atleta', _conn)['total'].iloc[0]
+    # Todas as contagens em uma única consulta (uma ida ao banco)
+    query = """
+    SELECT
+        (SELECT COUNT(*) FROM pagamento),
+        (SELECT COUNT(DISTINCT cpf) FROM atleta),
+        (SELECT SUM(valor_pago) FROM pagamento),
+        (SELECT COUNT(*) FROM modalidade),
+        (SELECT COUNT(*) FROM categoria),
+        (SELECT COUNT(*) FROM municipio)
+    """
+    row = get_valid_connection().execute(query).fetchone()
     
-    # Valor total pago
-    stats['valor_total'] = fetch_query('SELECT SUM(valor_pago) as total FROM pagamento', _conn)['total'].iloc[0]
+    stats = {
+        'total_pagamentos': row[0] or 0,
+        'total_atletas': row[1] or 0,
+        'valor_total': row[2] or 0.0,
+        'total_modalidades': row[3] or 0,
+        'total_categorias': row[4] or 0,
+        'total_municipios': row[5] or 0
+    }
     
     # Valor médio por pagamento
     stats['valor_medio'] = stats['valor_total'] / stats['total_pagamentos'] if stats['total_pagamentos'] > 0 else 0
     
-    # Total de modalidades
-    stats['total_modalidades'] = fetch_query('SELECT COUNT(*) as total FROM modalidade', _conn)['total'].iloc[0]
-    
-    # Total de categorias
-    stats['total_categorias'] = fetch_query('SELECT COUNT(*) as total FROM categoria', _conn)['total'].iloc[0]
-    
-    # Total de municípios
-    stats['total_municipios'] = fetch_query('SELECT COUNT(*) as total FROM municipio', _conn)['total'].iloc[0]
-    
     return stats
 
-# Função helper para garantir conexão válida
-def ensure_valid_connection(current_conn):
-    """Garante que a conexão passada está válida, retorna uma nova se necessário"""
-    if current_conn is None:
-        return get_valid_connection()
-    try:
-        current_conn.execute("SELECT 1")
-        return current_conn
-    except (sqlite3.ProgrammingError, sqlite3.OperationalError, sqlite3.InterfaceError):
-        return get_valid_connection()
+# Função para construir gráficos de barras reaproveitáveis entre reruns
+@st.cache_resource(show_spinner=False, max_entries=64)
+def make_bar_fig(sig: tuple, _df: pd.DataFrame, x: str, y: str, color: str, title: str,
+                 x_label: str, y_label: str, color_label: str, colorscale: str,
+                 orientation: str = 'v', text_template: str = None, tickangle: int = None,
+                 category_order: str = None, height: int = 400) -> go.Figure:
+    """Monta um gráfico de barras com go.Figure a partir das colunas x, y e color de _df
+
+    sig identifica o gráfico e os filtros que geraram _df (que fica fora da
+    chave do cache); a mesma assinatura reaproveita a figura já construída
+    """
+    # Colunas numéricas vão como arrays numpy, que o Plotly serializa como
+    # arrays tipados; rótulos categóricos viram texto
+    def axis_values(col: str):
+        return _df[col].to_numpy() if _df[col].dtype.kind in 'fiu' else _df[col].astype(str).to_numpy()
+
+    x_values, y_values = axis_values(x), axis_values(y)
+    values = x_values if orientation == 'h' else y_values
+    fig = go.Figure(go.Bar(
+        x=x_values,
+        y=y_values,
+        orientation=orientation,
+        marker=dict(color=_df[color].to_numpy(), colorscale=colorscale, showscale=True,
+                    colorbar=dict(title=color_label)),
+        text=values if text_template else None,
+        texttemplate=text_template,
+        textposition='outside' if text_template else None,
+        hovertemplate=f"{x_label}=%{{x}}<br>{y_label}=%{{y}}<br>{color_label}=%{{marker.color}}<extra></extra>"
+    ))
+    fig.update_layout(title=title, height=height, xaxis_title=x_label, yaxis_title=y_label)
+    if tickangle is not None:
+        fig.update_xaxes(tickangle=tickangle)
+    if category_order is not None:
+        if orientation == 'h':
+            fig.update_yaxes(categoryorder=category_order)
+        else:
+            fig.update_xaxes(categoryorder=category_order)
+    return fig
+
+# Função para juntar dois gráficos em uma única figura
+def side_by_side(fig_left: go.Figure, fig_right: go.Figure, height: int = 450) -> go.Figure:
+    """Coloca os traces de dois gráficos lado a lado com make_subplots, enviados e desenhados de uma vez"""
+    figs = (fig_left, fig_right)
+    types = ['domain' if any(trace.type == 'pie' for trace in fig.data) else 'xy' for fig in figs]
+    combo = make_subplots(rows=1, cols=2, specs=[[{'type': t} for t in types]],
+                          subplot_titles=[fig.layout.title.text for fig in figs])
+    for col, (fig, subplot_type) in enumerate(zip(figs, types), start=1):
+        for trace in fig.data:
+            combo.add_trace(trace, row=1, col=col)
+        if subplot_type == 'xy':
+            combo.update_xaxes(title_text=fig.layout.xaxis.title.text, row=1, col=col)
+            if fig.layout.xaxis.tickangle is not None:
+                combo.update_xaxes(tickangle=fig.layout.xaxis.tickangle, row=1, col=col)
+            combo.update_yaxes(title_text=fig.layout.yaxis.title.text, row=1, col=col)
+    combo.update_layout(height=height)
+    return combo
+
+# Função para exibir tabelas longas em páginas
+def show_df(df: pd.DataFrame, key: str, page_size: int = TABLE_PAGE_SIZE):
+    """Envia ao navegador só a página selecionada da tabela"""
+    if len(df) <= page_size:
+        st.dataframe(df, width='stretch')
+        return
+    n_pages = -(-len(df) // page_size)
+    # O número de páginas entra na key para que a seleção recomece quando o resultado muda de tamanho
+    pagina = st.number_input(f"Página (de {n_pages})", min_value=1, max_value=n_pages, value=1,
+                             key=f"{key}_{n_pages}")
+    st.dataframe(df.iloc[(pagina - 1) * page_size:pagina * page_size], width='stretch')
+
+# Função para calcular os totais exibidos nas métricas de uma página
+def page_totals(from_clause: str, where: str = "", params: tuple = ()) -> dict:
+    """Retorna numa única linha os totais de pagamentos, atletas e valores calculados no SQLite"""
+    query = f"""
+    SELECT 
+        COUNT(p.id_pagamento) as num_pagamentos,
+        COUNT(DISTINCT p.cpf) as num_atletas,
+        COALESCE(SUM(p.valor_pago), 0) as valor_total,
+        COALESCE(AVG(p.valor_pago), 0) as valor_medio
+    {from_clause}
+    {where}
+    """
+    return cached_query(query, params).to_dict('records')[0]
+
+# Função para reduzir séries longas antes de desenhá-las
+def downsample_series(df: pd.DataFrame, y: str, max_points: int = DOWNSAMPLE_MAX_POINTS) -> pd.DataFrame:
+    """Divide a série em faixas e mantém só as linhas de mínimo e máximo de cada uma"""
+    if len(df) <= max_points:
+        return df
+    values = df[y].reset_index(drop=True)
+    buckets = pd.Series(range(len(values))) * (max_points // 2) // len(values)
+    grouped = values.groupby(buckets)
+    keep = pd.concat([grouped.idxmin(), grouped.idxmax()]).drop_duplicates().sort_values()
+    return df.iloc[keep.to_numpy()]
 
 # Conexão com o banco de dados (sempre obtém uma conexão válida)
 conn = get_valid_connection()
@@ -130,13 +365,17 @@ st.sidebar.title("🔧 Filtros Globais")
 @st.cache_data
 def get_filter_options(_conn):
     """Carrega opções para os filtros"""
-    categorias = fetch_query('SELECT categoria FROM categoria ORDER BY categoria', _conn)['categoria'].tolist()
-    modalidades = fetch_query('SELECT modalidade FROM modalidade ORDER BY modalidade', _conn)['modalidade'].tolist()
-    estados = fetch_query('SELECT DISTINCT uf FROM municipio ORDER BY uf', _conn)['uf'].tolist()
-    
-    # Obter range de datas
-    min_date = fetch_query('SELECT MIN(data_pagamento) as min_date FROM pagamento WHERE data_pagamento IS NOT NULL', _conn)['min_date'].iloc[0]
-    max_date = fetch_query('SELECT MAX(data_pagamento) as max_date FROM pagamento WHERE data_pagamento IS NOT NULL', _conn)['max_date'].iloc[0]
+    conn = get_valid_connection()
+    # Categorias e modalidades vêm das dimensões já carregadas em memória
+    dims = load_dimensions()
+    categorias = sorted(dims['categoria'].astype(str))
+    modalidades = sorted(dims['modalidade'].astype(str))
+    estados = [row[0] for row in conn.execute('SELECT DISTINCT uf FROM municipio ORDER BY uf')]
+    
+    # Obter range de datas em uma única consulta
+    min_date, max_date = conn.execute(
+        'SELECT MIN(data_pagamento), MAX(data_pagamento) FROM pagamento WHERE data_pagamento IS NOT NULL'
+    ).fetchone()
     
     return {
         'categorias': categorias,
@@ -225,38 +464,70 @@ else:
 
 # Função para construir cláusula WHERE baseada nos filtros
 def build_where_clause():
-    """Constrói cláusula WHERE baseada nos filtros selecionados"""
+    """Constrói cláusula WHERE parametrizada baseada nos filtros selecionados
+    
+    Retorna uma tupla (and_clause, params). and_clause é "" sem filtros ou
+    "AND ..." com placeholders `?`, para ser anexada a um `WHERE 1=1`;
+    params contém os valores na mesma ordem.
+    """
     conditions = []
+    params = []
     
+    # Valores das listas ficam nas tabelas temporárias (ver load_filter_tables),
+    # mantendo o texto SQL constante para qualquer seleção
     if filtro_categoria:
-        cats = "', '".join(filtro_categoria)
-        conditions.append(f"c.categoria IN ('{cats}')")
+        conditions.append("c.categoria IN (SELECT v FROM f_cat)")
     
     if filtro_modalidade:
-        mods = "', '".join(filtro_modalidade)
-        conditions.append(f"m.modalidade IN ('{mods}')")
+        conditions.append("m.modalidade IN (SELECT v FROM f_mod)")
     
     if filtro_estado:
-        ufs = "', '".join(filtro_estado)
-        conditions.append(f"mu.uf IN ('{ufs}')")
+        conditions.append("mu.uf IN (SELECT v FROM f_uf)")
     
     # Só aplica filtros de data se o checkbox estiver marcado
     if use_date_filter:
         if filtro_data_inicio:
-            conditions.append(f"p.data_pagamento >= '{filtro_data_inicio}'")
+            conditions.append("p.data_pagamento >= ?")
+            params.append(str(filtro_data_inicio))
         
         if filtro_data_fim:
-            conditions.append(f"p.data_pagamento <= '{filtro_data_fim}'")
+            conditions.append("p.data_pagamento <= ?")
+            params.append(str(filtro_data_fim))
     
     # Só aplica filtros de valor se o checkbox estiver marcado
     if use_value_filter:
         if filtro_valor_min > 0:
-            conditions.append(f"p.valor_pago >= {filtro_valor_min}")
+            conditions.append("p.valor_pago >= ?")
+            params.append(filtro_valor_min)
         
         if filtro_valor_max > 0:
-            conditions.append(f"p.valor_pago <= {filtro_valor_max}")
+            conditions.append("p.valor_pago <= ?")
+            params.append(filtro_valor_max)
     
-    return " AND ".join(conditions) if conditions else None
+    if not conditions:
+        return "", []
+    return "AND " + " AND ".join(conditions), params
+
+# Função para carregar os filtros de lista em tabelas temporárias
+def load_filter_tables(conn):
+    """Grava os valores selecionados nos filtros de lista nas tabelas temporárias f_cat, f_mod e f_uf"""
+    # A conexão é query_only; a escrita nas tabelas temporárias é liberada
+    # só durante esta função
+    conn.execute("PRAGMA query_only = OFF")
+    try:
+        for table, values in (('f_cat', filtro_categoria), ('f_mod', filtro_modalidade), ('f_uf', filtro_estado)):
+            conn.execute(f"CREATE TEMP TABLE IF NOT EXISTS {table}(v TEXT PRIMARY KEY)")
+            conn.execute(f"DELETE FROM {table}")
+            conn.executemany(f"INSERT INTO {table} VALUES (?)", [(v,) for v in values])
+        conn.commit()
+    finally:
+        conn.execute("PRAGMA query_only = ON")
+
+# Assinatura hashable do estado dos filtros, calculada uma vez por rerun e
+# usada como chave explícita dos resultados em cache
+filter_sig = (tuple(filtro_categoria), tuple(filtro_modalidade), tuple(filtro_estado),
+              use_date_filter, filtro_data_inicio, filtro_data_fim,
+              use_value_filter, filtro_valor_min, filtro_valor_max)
 
 # Botão para limpar filtros
 if st.sidebar.button("🔄 Limpar Filtros"):
@@ -269,12 +540,15 @@ st.sidebar.info("💡 **Dica:** Use os filtros acima para personalizar as visual
 st.title("🏃 Dashboard - Bolsa Atleta")
 st.markdown("---")
 
+# Cada st.plotly_chart recebe uma key fixa: entre reruns o Streamlit atualiza
+# o gráfico já existente no navegador em vez de recriá-lo
+
 # ========== PÁGINA 1: VISÃO GERAL (DASHBOARD COMPLETO) ==========
 if page == "Visão Geral":
     st.header("📈 Dashboard Executivo - Bolsa Atleta")
     
     # Aplicar filtros na query
-    where_clause = build_where_clause()
+    and_clause, where_params = build_where_clause()
     join_clause = """
     FROM pagamento p
     JOIN categoria c ON p.id_categoria = c.id_categoria
@@ -283,41 +557,45 @@ if page == "Visão Geral":
     JOIN municipio mu ON a.id_municipio = mu.id_municipio
     """
     
-    if where_clause:
-        base_query = f"SELECT * {join_clause} WHERE {where_clause}"
-    else:
-        base_query = f"SELECT * {join_clause}"
+    # Linhas base: o JOIN é executado uma única vez e todos os gráficos
+    # da página são agregados a partir deste DataFrame
+    base_columns = """
+    SELECT 
+        c.categoria,
+        m.modalidade,
+        mu.uf,
+        mu.municipio,
+        p.cpf,
+        p.id_pagamento,
+        p.valor_pago
+    """
+    base_query = f"{base_columns} {join_clause} WHERE 1=1 {and_clause}"
     
-    # Garantir que temos uma conexão válida antes de executar queries
-    conn = ensure_valid_connection(conn)
+    # Conexão da thread atual (reaberta se fetch_query a descartou após uma falha)
+    conn = get_valid_connection()
+    load_filter_tables(conn)
     
-    # Obter estatísticas com filtros
-    if where_clause:
-        query_stats = f"""
-        SELECT 
-            COUNT(*) as total_pagamentos,
-            COUNT(DISTINCT p.cpf) as total_atletas,
-            SUM(p.valor_pago) as valor_total,
-            AVG(p.valor_pago) as valor_medio
-        {join_clause}
-        WHERE {where_clause}
-        """
-    else:
-        query_stats = """
-        SELECT 
-            COUNT(*) as total_pagamentos,
-            COUNT(DISTINCT p.cpf) as total_atletas,
-            SUM(p.valor_pago) as valor_total,
-            AVG(p.valor_pago) as valor_medio
-        FROM pagamento p
-        """
+    df_base = cached_query(base_query, tuple(where_params), filter_sig, arrow=True)
     
-    df_stats = fetch_query(query_stats, conn)
+    # Obter estatísticas com filtros; sem filtros (carga inicial da página)
+    # os JOINs não alteram o resultado e a consulta lê apenas pagamento
+    stats_from = join_clause if and_clause else "FROM pagamento p"
+    query_stats = f"""
+    SELECT 
+        COUNT(*) as total_pagamentos,
+        COUNT(DISTINCT p.cpf) as total_atletas,
+        SUM(p.valor_pago) as valor_total,
+        AVG(p.valor_pago) as valor_medio
+    {stats_from}
+    WHERE 1=1 {and_clause}
+    """
+    
+    row_stats = conn.execute(query_stats, where_params).fetchone()
     stats = {
-        'total_pagamentos': int(df_stats['total_pagamentos'].iloc[0]) if not df_stats.empty else 0,
-        'total_atletas': int(df_stats['total_atletas'].iloc[0]) if not df_stats.empty else 0,
-        'valor_total': float(df_stats['valor_total'].iloc[0]) if not df_stats.empty and pd.notna(df_stats['valor_total'].iloc[0]) else 0.0,
-        'valor_medio': float(df_stats['valor_medio'].iloc[0]) if not df_stats.empty and pd.notna(df_stats['valor_medio'].iloc[0]) else 0.0
+        'total_pagamentos': int(row_stats[0] or 0),
+        'total_atletas': int(row_stats[1] or 0),
+        'valor_total': float(row_stats[2]) if row_stats[2] is not None else 0.0,
+        'valor_medio': float(row_stats[3]) if row_stats[3] is not None else 0.0
     }
     
     # Métricas principais com cards destacados
@@ -358,85 +636,37 @@ if page == "Visão Geral":
     
     with col1:
         st.subheader("💰 Distribuição de Valores Pagos")
-        if where_clause:
-            query_valores = f"""
-            SELECT 
-                CASE 
-                    WHEN p.valor_pago < 1000 THEN 'Até R$ 1.000'
-                    WHEN p.valor_pago < 2000 THEN 'R$ 1.000 - R$ 2.000'
-                    WHEN p.valor_pago < 3000 THEN 'R$ 2.000 - R$ 3.000'
-                    WHEN p.valor_pago < 5000 THEN 'R$ 3.000 - R$ 5.000'
-                    ELSE 'Acima de R$ 5.000'
-                END as faixa_valor,
-                COUNT(*) as quantidade
-            {join_clause}
-            WHERE {where_clause}
-            GROUP BY faixa_valor
-            ORDER BY MIN(p.valor_pago)
-            """
-        else:
-            query_valores = """
-            SELECT 
-                CASE 
-                    WHEN valor_pago < 1000 THEN 'Até R$ 1.000'
-                    WHEN valor_pago < 2000 THEN 'R$ 1.000 - R$ 2.000'
-                    WHEN valor_pago < 3000 THEN 'R$ 2.000 - R$ 3.000'
-                    WHEN valor_pago < 5000 THEN 'R$ 3.000 - R$ 5.000'
-                    ELSE 'Acima de R$ 5.000'
-                END as faixa_valor,
-                COUNT(*) as quantidade
-            FROM pagamento
-            GROUP BY faixa_valor
-            ORDER BY MIN(valor_pago)
-            """
-        df_valores = fetch_query(query_valores, conn)
+        faixas = pd.cut(df_base['valor_pago'],
+                        bins=[float('-inf'), 1000, 2000, 3000, 5000, float('inf')],
+                        labels=['Até R$ 1.000', 'R$ 1.000 - R$ 2.000', 'R$ 2.000 - R$ 3.000',
+                                'R$ 3.000 - R$ 5.000', 'Acima de R$ 5.000'],
+                        right=False)
+        df_valores = (df_base.groupby(faixas, observed=True).size()
+                      .rename_axis('faixa_valor').reset_index(name='quantidade'))
         if not df_valores.empty:
-            fig_valores = px.bar(df_valores, x='faixa_valor', y='quantidade', 
-                                title="Pagamentos por Faixa de Valor",
-                                labels={'faixa_valor': 'Faixa de Valor', 'quantidade': 'Quantidade'},
-                                color='quantidade',
-                                color_continuous_scale='Blues')
-            fig_valores.update_layout(height=400)
-            st.plotly_chart(fig_valores, width='stretch')
+            fig_valores = make_bar_fig(('df_valores', filter_sig), df_valores,
+                                       'faixa_valor', 'quantidade', 'quantidade',
+                                       title="Pagamentos por Faixa de Valor",
+                                       x_label='Faixa de Valor', y_label='Quantidade',
+                                       color_label='Quantidade', colorscale='Blues')
+            st.plotly_chart(fig_valores, width='stretch', key="vg_valores")
         else:
             st.info("📊 Nenhum dado encontrado para esta visualização com os filtros aplicados.")
     
     with col2:
         st.subheader("💵 Valor Médio por Categoria")
-        if where_clause:
-            query_valor_medio = f"""
-            SELECT 
-                c.categoria,
-                AVG(p.valor_pago) as valor_medio,
-                COUNT(p.id_pagamento) as num_pagamentos
-            {join_clause}
-            WHERE {where_clause}
-            GROUP BY c.categoria
-            ORDER BY valor_medio DESC
-            """
-        else:
-            query_valor_medio = """
-            SELECT 
-                c.categoria,
-                AVG(p.valor_pago) as valor_medio,
-                COUNT(p.id_pagamento) as num_pagamentos
-            FROM pagamento p
-            JOIN categoria c ON p.id_categoria = c.id_categoria
-            GROUP BY c.categoria
-            ORDER BY valor_medio DESC
-            """
-        df_valor_medio = fetch_query(query_valor_medio, conn)
+        df_valor_medio = (df_base.groupby('categoria', as_index=False, observed=True)
+                          .agg(valor_medio=('valor_pago', 'mean'),
+                               num_pagamentos=('id_pagamento', 'count'))
+                          .sort_values('valor_medio', ascending=False, kind='stable'))
         if not df_valor_medio.empty:
-            fig_valor_medio = px.bar(df_valor_medio, x='categoria', y='valor_medio',
-                                     title="Valor Médio de Pagamento por Categoria",
-                                     labels={'categoria': 'Categoria', 'valor_medio': 'Valor Médio (R$)'},
-                                     color='valor_medio',
-                                     color_continuous_scale='Greens',
-                                     text='valor_medio')
-            fig_valor_medio.update_traces(texttemplate='R$ %{text:,.2f}', textposition='outside')
-            fig_valor_medio.update_xaxes(tickangle=45)
-            fig_valor_medio.update_layout(height=400)
-            st.plotly_chart(fig_valor_medio, width='stretch')
+            fig_valor_medio = make_bar_fig(('df_valor_medio', filter_sig), df_valor_medio,
+                                           'categoria', 'valor_medio', 'valor_medio',
+                                           title="Valor Médio de Pagamento por Categoria",
+                                           x_label='Categoria', y_label='Valor Médio (R$)',
+                                           color_label='Valor Médio (R$)', colorscale='Greens',
+                                           text_template='R$ %{text:,.2f}', tickangle=45)
+            st.plotly_chart(fig_valor_medio, width='stretch', key="vg_valor_medio")
         else:
             st.info("📊 Nenhum dado encontrado para esta visualização com os filtros aplicados.")
     
@@ -447,74 +677,34 @@ if page == "Visão Geral":
     
     with col1:
         st.subheader("🏅 Top 10 Modalidades por Valor Total")
-        if where_clause:
-            query_top_modalidades = f"""
-            SELECT 
-                m.modalidade,
-                COUNT(p.id_pagamento) as num_pagamentos,
-                SUM(p.valor_pago) as valor_total
-            {join_clause}
-            WHERE {where_clause}
-            GROUP BY m.modalidade
-            ORDER BY valor_total DESC
-            LIMIT 10
-            """
-        else:
-            query_top_modalidades = """
-            SELECT 
-                m.modalidade,
-                COUNT(p.id_pagamento) as num_pagamentos,
-                SUM(p.valor_pago) as valor_total
-            FROM pagamento p
-            JOIN modalidade m ON p.id_modalidade = m.id_modalidade
-            GROUP BY m.modalidade
-            ORDER BY valor_total DESC
-            LIMIT 10
-            """
-        df_top_modalidades = fetch_query(query_top_modalidades, conn)
+        df_top_modalidades = (df_base.groupby('modalidade', as_index=False, observed=True)
+                              .agg(num_pagamentos=('id_pagamento', 'count'),
+                                   valor_total=('valor_pago', 'sum'))
+                              .sort_values('valor_total', ascending=False, kind='stable')
+                              .head(10))
         if not df_top_modalidades.empty:
-            fig_top_modalidades = px.bar(df_top_modalidades, x='modalidade', y='valor_total',
-                                        title="Top 10 Modalidades",
-                                        labels={'modalidade': 'Modalidade', 'valor_total': 'Valor Total (R$)'},
-                                        color='valor_total',
-                                        color_continuous_scale='Viridis')
-            fig_top_modalidades.update_xaxes(tickangle=45)
-            fig_top_modalidades.update_layout(height=400)
-            st.plotly_chart(fig_top_modalidades, width='stretch')
+            fig_top_modalidades = make_bar_fig(('df_top_modalidades', filter_sig), df_top_modalidades,
+                                               'modalidade', 'valor_total', 'valor_total',
+                                               title="Top 10 Modalidades",
+                                               x_label='Modalidade', y_label='Valor Total (R$)',
+                                               color_label='Valor Total (R$)', colorscale='Viridis',
+                                               tickangle=45)
+            st.plotly_chart(fig_top_modalidades, width='stretch', key="vg_top_modalidades")
         else:
             st.info("📊 Nenhum dado encontrado para esta visualização com os filtros aplicados.")
     
     with col2:
         st.subheader("📊 Distribuição por Categoria")
-        if where_clause:
-            query_cat = f"""
-            SELECT 
-                c.categoria,
-                COUNT(p.id_pagamento) as num_pagamentos,
-                SUM(p.valor_pago) as valor_total
-            {join_clause}
-            WHERE {where_clause}
-            GROUP BY c.categoria
-            ORDER BY valor_total DESC
-            """
-        else:
-            query_cat = """
-            SELECT 
-                c.categoria,
-                COUNT(p.id_pagamento) as num_pagamentos,
-                SUM(p.valor_pago) as valor_total
-            FROM pagamento p
-            JOIN categoria c ON p.id_categoria = c.id_categoria
-            GROUP BY c.categoria
-            ORDER BY valor_total DESC
-            """
-        df_cat = fetch_query(query_cat, conn)
+        df_cat = (df_base.groupby('categoria', as_index=False, observed=True)
+                  .agg(num_pagamentos=('id_pagamento', 'count'),
+                       valor_total=('valor_pago', 'sum'))
+                  .sort_values('valor_total', ascending=False, kind='stable'))
         if not df_cat.empty:
             fig_cat = px.pie(df_cat, values='valor_total', names='categoria',
                             title="Distribuição de Valores por Categoria",
                             hole=0.4)
             fig_cat.update_layout(height=400)
-            st.plotly_chart(fig_cat, width='stretch')
+            st.plotly_chart(fig_cat, width='stretch', key="vg_categoria")
         else:
             st.info("📊 Nenhum dado encontrado para esta visualização com os filtros aplicados.")
     
@@ -525,80 +715,37 @@ if page == "Visão Geral":
     
     with col1:
         st.subheader("🗺️ Top 10 Estados por Valor Total")
-        if where_clause:
-            query_estados = f"""
-            SELECT 
-                mu.uf,
-                COUNT(DISTINCT a.cpf) as num_atletas,
-                SUM(p.valor_pago) as valor_total
-            {join_clause}
-            WHERE {where_clause}
-            GROUP BY mu.uf
-            ORDER BY valor_total DESC
-            LIMIT 10
-            """
-        else:
-            query_estados = """
-            SELECT 
-                mu.uf,
-                COUNT(DISTINCT a.cpf) as num_atletas,
-                SUM(p.valor_pago) as valor_total
-            FROM pagamento p
-            JOIN atleta a ON p.cpf = a.cpf
-            JOIN municipio mu ON a.id_municipio = mu.id_municipio
-            GROUP BY mu.uf
-            ORDER BY valor_total DESC
-            LIMIT 10
-            """
-        df_estados = fetch_query(query_estados, conn)
+        df_estados = (df_base.groupby('uf', as_index=False, observed=True)
+                      .agg(num_atletas=('cpf', 'nunique'),
+                           valor_total=('valor_pago', 'sum'))
+                      .sort_values('valor_total', ascending=False, kind='stable')
+                      .head(10))
         if not df_estados.empty:
-            fig_estados = px.bar(df_estados, x='uf', y='valor_total',
-                                title="Top 10 Estados",
-                                labels={'uf': 'Estado', 'valor_total': 'Valor Total (R$)'},
-                                color='num_atletas',
-                                color_continuous_scale='Reds')
-            fig_estados.update_layout(height=400)
-            st.plotly_chart(fig_estados, width='stretch')
+            fig_estados = make_bar_fig(('df_estados', filter_sig), df_estados,
+                                       'uf', 'valor_total', 'num_atletas',
+                                       title="Top 10 Estados",
+                                       x_label='Estado', y_label='Valor Total (R$)',
+                                       color_label='num_atletas', colorscale='Reds')
+            st.plotly_chart(fig_estados, width='stretch', key="vg_estados")
         else:
             st.info("📊 Nenhum dado encontrado para esta visualização com os filtros aplicados.")
     
     with col2:
         st.subheader("🏆 Top 10 Municípios por Valor Total")
-        if where_clause:
-            query_municipios = f"""
-            SELECT 
-                mu.municipio || ' - ' || mu.uf as localizacao,
-                COUNT(DISTINCT a.cpf) as num_atletas,
-                SUM(p.valor_pago) as valor_total
-            {join_clause}
-            WHERE {where_clause}
-            GROUP BY mu.municipio, mu.uf
-            ORDER BY valor_total DESC
-            LIMIT 10
-            """
-        else:
-            query_municipios = """
-            SELECT 
-                mu.municipio || ' - ' || mu.uf as localizacao,
-                COUNT(DISTINCT a.cpf) as num_atletas,
-                SUM(p.valor_pago) as valor_total
-            FROM pagamento p
-            JOIN atleta a ON p.cpf = a.cpf
-            JOIN municipio mu ON a.id_municipio = mu.id_municipio
-            GROUP BY mu.municipio, mu.uf
-            ORDER BY valor_total DESC
-            LIMIT 10
-            """
-        df_municipios = fetch_query(query_municipios, conn)
+        df_municipios = (df_base.groupby(['municipio', 'uf'], as_index=False, observed=True)
+                         .agg(num_atletas=('cpf', 'nunique'),
+                              valor_total=('valor_pago', 'sum'))
+                         .assign(localizacao=lambda df: df['municipio'].astype(str) + ' - ' + df['uf'].astype(str))
+                         .sort_values('valor_total', ascending=False, kind='stable')
+                         .head(10))
         if not df_municipios.empty:
-            fig_municipios = px.bar(df_municipios, x='valor_total', y='localizacao',
-                                   orientation='h',
-                                   title="Top 10 Municípios por Valor Total",
-                                   labels={'localizacao': 'Município - UF', 'valor_total': 'Valor Total (R$)'},
-                                   color='num_atletas',
-                                   color_continuous_scale='Oranges')
-            fig_municipios.update_layout(height=400, yaxis={'categoryorder': 'total ascending'})
-            st.plotly_chart(fig_municipios, width='stretch')
+            fig_municipios = make_bar_fig(('df_municipios', filter_sig), df_municipios,
+                                          'valor_total', 'localizacao', 'num_atletas',
+                                          title="Top 10 Municípios por Valor Total",
+                                          x_label='Valor Total (R$)', y_label='Município - UF',
+                                          color_label='num_atletas', colorscale='Oranges',
+                                          orientation='h', category_order='total ascending')
+            st.plotly_chart(fig_municipios, width='stretch', key="vg_municipios")
         else:
             st.info("📊 Nenhum dado encontrado para esta visualização com os filtros aplicados.")
     
@@ -609,85 +756,47 @@ if page == "Visão Geral":
     
     with col1:
         st.subheader("📊 Comparação: Modalidades com Mais Atletas")
-        if where_clause:
-            query_modalidades_atletas = f"""
-            SELECT 
-                m.modalidade,
-                COUNT(DISTINCT p.cpf) as num_atletas,
-                SUM(p.valor_pago) as valor_total,
-                AVG(p.valor_pago) as valor_medio
-            {join_clause}
-            WHERE {where_clause}
-            GROUP BY m.modalidade
-            ORDER BY num_atletas DESC
-            LIMIT 10
-            """
-        else:
-            query_modalidades_atletas = """
-            SELECT 
-                m.modalidade,
-                COUNT(DISTINCT p.cpf) as num_atletas,
-                SUM(p.valor_pago) as valor_total,
-                AVG(p.valor_pago) as valor_medio
-            FROM pagamento p
-            JOIN modalidade m ON p.id_modalidade = m.id_modalidade
-            GROUP BY m.modalidade
-            ORDER BY num_atletas DESC
-            LIMIT 10
-            """
-        df_modalidades_atletas = fetch_query(query_modalidades_atletas, conn)
+        df_modalidades_atletas = (df_base.groupby('modalidade', as_index=False, observed=True)
+                                  .agg(num_atletas=('cpf', 'nunique'),
+                                       valor_total=('valor_pago', 'sum'),
+                                       valor_medio=('valor_pago', 'mean'))
+                                  .sort_values('num_atletas', ascending=False, kind='stable')
+                                  .head(10))
         if not df_modalidades_atletas.empty:
-            fig_modalidades = px.bar(df_modalidades_atletas, x='modalidade', y='num_atletas',
-                                    title="Top 10 Modalidades por Número de Atletas",
-                                    labels={'modalidade': 'Modalidade', 'num_atletas': 'Número de Atletas'},
-                                    color='valor_total',
-                                    color_continuous_scale='Purples',
-                                    text='num_atletas')
-            fig_modalidades.update_traces(texttemplate='%{text}', textposition='outside')
-            fig_modalidades.update_xaxes(tickangle=45)
-            fig_modalidades.update_layout(height=400)
-            st.plotly_chart(fig_modalidades, width='stretch')
+            fig_modalidades = make_bar_fig(('df_modalidades_atletas', filter_sig), df_modalidades_atletas,
+                                           'modalidade', 'num_atletas', 'valor_total',
+                                           title="Top 10 Modalidades por Número de Atletas",
+                                           x_label='Modalidade', y_label='Número de Atletas',
+                                           color_label='valor_total', colorscale='Purples',
+                                           text_template='%{text}', tickangle=45)
+            st.plotly_chart(fig_modalidades, width='stretch', key="vg_modalidades_atletas")
         else:
             st.info("📊 Nenhum dado encontrado para esta visualização com os filtros aplicados.")
     
     with col2:
         st.subheader("🗺️ Distribuição Geográfica por Estado")
-        if where_clause:
-            query_dist_geo = f"""
-            SELECT 
-                mu.uf,
-                COUNT(DISTINCT a.cpf) as num_atletas,
-                COUNT(p.id_pagamento) as num_pagamentos,
-                SUM(p.valor_pago) as valor_total
-            {join_clause}
-            WHERE {where_clause}
-            GROUP BY mu.uf
-            ORDER BY valor_total DESC
-            """
-        else:
-            query_dist_geo = """
-            SELECT 
-                mu.uf,
-                COUNT(DISTINCT a.cpf) as num_atletas,
-                COUNT(p.id_pagamento) as num_pagamentos,
-                SUM(p.valor_pago) as valor_total
-            FROM pagamento p
-            JOIN atleta a ON p.cpf = a.cpf
-            JOIN municipio mu ON a.id_municipio = mu.id_municipio
-            GROUP BY mu.uf
-            ORDER BY valor_total DESC
-            """
-        df_dist_geo = fetch_query(query_dist_geo, conn)
+        df_dist_geo = (df_base.groupby('uf', as_index=False, observed=True)
+                       .agg(num_atletas=('cpf', 'nunique'),
+                            num_pagamentos=('id_pagamento', 'count'),
+                            valor_total=('valor_pago', 'sum'))
+                       .sort_values('valor_total', ascending=False, kind='stable'))
+        # Descarta estados com menos de 0,25% do valor total, que virariam
+        # células ilegíveis no treemap
+        df_dist_geo = df_dist_geo[df_dist_geo['valor_total'] > TREEMAP_MIN_SHARE * df_dist_geo['valor_total'].sum()]
         if not df_dist_geo.empty:
-            fig_dist_geo = px.treemap(df_dist_geo, 
-                                      path=['uf'], 
-                                      values='valor_total',
-                                      color='num_atletas',
-                                      title="Distribuição de Valores por Estado",
-                                      color_continuous_scale='RdBu',
-                                      hover_data=['num_atletas', 'num_pagamentos'])
-            fig_dist_geo.update_layout(height=400)
-            st.plotly_chart(fig_dist_geo, width='stretch')
+            fig_dist_geo = go.Figure(go.Treemap(
+                labels=df_dist_geo['uf'].tolist(),
+                parents=[''] * len(df_dist_geo),
+                values=df_dist_geo['valor_total'].tolist(),
+                branchvalues='total',
+                marker=dict(colors=df_dist_geo['num_atletas'].tolist(), colorscale='RdBu',
+                            showscale=True, colorbar=dict(title='num_atletas')),
+                customdata=df_dist_geo[['num_atletas', 'num_pagamentos']].to_numpy(),
+                hovertemplate="uf=%{label}<br>valor_total=%{value}<br>num_atletas=%{customdata[0]}"
+                              "<br>num_pagamentos=%{customdata[1]}<extra></extra>"
+            ))
+            fig_dist_geo.update_layout(title="Distribuição de Valores por Estado", height=400)
+            st.plotly_chart(fig_dist_geo, width='stretch', key="vg_dist_geo")
         else:
             st.info("📊 Nenhum dado encontrado para esta visualização com os filtros aplicados.")
     
@@ -695,227 +804,212 @@ if page == "Visão Geral":
     
     # Tabela resumo
     st.subheader("📋 Resumo Detalhado")
-    if where_clause:
-        query_resumo = f"""
-        SELECT 
-            c.categoria,
-            m.modalidade,
-            mu.uf,
-            COUNT(DISTINCT p.cpf) as num_atletas,
-            COUNT(p.id_pagamento) as num_pagamentos,
-            SUM(p.valor_pago) as valor_total,
-            AVG(p.valor_pago) as valor_medio
-        {join_clause}
-        WHERE {where_clause}
-        GROUP BY c.categoria, m.modalidade, mu.uf
-        ORDER BY valor_total DESC
-        LIMIT 50
-        """
-    else:
-        query_resumo = """
-        SELECT 
-            c.categoria,
-            m.modalidade,
-            mu.uf,
-            COUNT(DISTINCT p.cpf) as num_atletas,
-            COUNT(p.id_pagamento) as num_pagamentos,
-            SUM(p.valor_pago) as valor_total,
-            AVG(p.valor_pago) as valor_medio
-        FROM pagamento p
-        JOIN categoria c ON p.id_categoria = c.id_categoria
-        JOIN modalidade m ON p.id_modalidade = m.id_modalidade
-        JOIN atleta a ON p.cpf = a.cpf
-        JOIN municipio mu ON a.id_municipio = mu.id_municipio
-        GROUP BY c.categoria, m.modalidade, mu.uf
-        ORDER BY valor_total DESC
-        LIMIT 50
-        """
-    df_resumo = fetch_query(query_resumo, conn)
+    df_resumo = (df_base.groupby(['categoria', 'modalidade', 'uf'], as_index=False, observed=True)
+                 .agg(num_atletas=('cpf', 'nunique'),
+                      num_pagamentos=('id_pagamento', 'count'),
+                      valor_total=('valor_pago', 'sum'),
+                      valor_medio=('valor_pago', 'mean'))
+                 .sort_values('valor_total', ascending=False, kind='stable')
+                 .head(50)
+                 .reset_index(drop=True))
     if not df_resumo.empty:
-        # Formatar valores para exibição
-        df_resumo['valor_total'] = df_resumo['valor_total'].apply(lambda x: f"R$ {x:,.2f}")
-        df_resumo['valor_medio'] = df_resumo['valor_medio'].apply(lambda x: f"R$ {x:,.2f}")
-        st.dataframe(df_resumo, width='stretch', height=400)
+        # Valores formatados no cliente; as colunas continuam numéricas
+        st.dataframe(df_resumo, width='stretch', height=400,
+                     column_config={
+                         'valor_total': st.column_config.NumberColumn("valor_total", format="R$ %.2f"),
+                         'valor_medio': st.column_config.NumberColumn("valor_medio", format="R$ %.2f")
+                     })
 
 # ========== PÁGINA 2: ANÁLISE POR CATEGORIA ==========
 elif page == "Análise por Categoria":
     st.header("📊 Análise por Categoria")
     
-    # Obter todas as categorias
-    categorias = fetch_query('SELECT categoria FROM categoria ORDER BY categoria', conn)['categoria'].tolist()
+    # Todas as categorias (já carregadas para os filtros globais)
+    categorias = filter_options['categorias']
     
     # Filtros
     categoria_selecionada = st.selectbox("Selecione uma categoria:", ["Todas"] + categorias)
     
-    # Query base
-    if categoria_selecionada == "Todas":
-        query_categoria = """
-        SELECT 
-            c.categoria,
-            COUNT(p.id_pagamento) as num_pagamentos,
-            COUNT(DISTINCT p.cpf) as num_atletas,
-            SUM(p.valor_pago) as valor_total,
-            AVG(p.valor_pago) as valor_medio
-        FROM pagamento p
-        JOIN categoria c ON p.id_categoria = c.id_categoria
-        GROUP BY c.categoria
-        ORDER BY valor_total DESC
-        """
-    else:
-        query_categoria = f"""
+    # Agregado de todas as categorias, em cache, agrupado só pelo id (índice
+    # ix_pag_cat_cov); o nome vem da dimensão pré-carregada e a seleção é um recorte em pandas
+    query_categoria = f"""
+    SELECT 
+        g.id_categoria,
+        g.num_pagamentos,
+        s.num_atletas,
+        g.valor_total,
+        g.valor_medio
+    FROM (
         SELECT 
-            c.categoria,
-            COUNT(p.id_pagamento) as num_pagamentos,
-            COUNT(DISTINCT p.cpf) as num_atletas,
-            SUM(p.valor_pago) as valor_total,
-            AVG(p.valor_pago) as valor_medio
-        FROM pagamento p
-        JOIN categoria c ON p.id_categoria = c.id_categoria
-        WHERE c.categoria = '{categoria_selecionada}'
-        GROUP BY c.categoria
-        """
+            id_categoria,
+            COUNT(id_pagamento) as num_pagamentos,
+            SUM(valor_pago) as valor_total,
+            AVG(valor_pago) as valor_medio
+        FROM pagamento
+        GROUP BY id_categoria
+    ) g
+    JOIN {stats_source('_stats_categoria')} s ON s.id_categoria = g.id_categoria
+    ORDER BY valor_total DESC
+    """
     
-    df_categoria = fetch_query(query_categoria, conn)
+    df_categoria = attach_dimension(cached_query(query_categoria), 'categoria')
+    if categoria_selecionada != "Todas":
+        df_categoria = df_categoria[df_categoria['categoria'] == categoria_selecionada].reset_index(drop=True)
+        totais = page_totals("FROM pagamento p", "WHERE p.id_categoria = ?",
+                             (dimension_id('categoria', categoria_selecionada),))
+    else:
+        totais = page_totals("FROM pagamento p")
     
     # Métricas
     if not df_categoria.empty:
         col1, col2, col3, col4 = st.columns(4)
         with col1:
-            st.metric("Pagamentos", f"{df_categoria['num_pagamentos'].sum():,}")
+            st.metric("Pagamentos", f"{totais['num_pagamentos']:,}")
         with col2:
-            st.metric("Atletas", f"{df_categoria['num_atletas'].sum():,}")
+            st.metric("Atletas", f"{totais['num_atletas']:,}")
         with col3:
-            st.metric("Valor Total", f"R$ {df_categoria['valor_total'].sum():,.2f}")
+            st.metric("Valor Total", f"R$ {totais['valor_total']:,.2f}")
         with col4:
-            st.metric("Valor Médio", f"R$ {df_categoria['valor_medio'].mean():,.2f}")
+            st.metric("Valor Médio", f"R$ {totais['valor_medio']:,.2f}")
         
         st.markdown("---")
         
-        # Gráficos
-        col1, col2 = st.columns(2)
+        # Gráficos: os dois em uma única figura (make_subplots)
         
-        with col1:
-            fig_pizza = px.pie(df_categoria, values='valor_total', names='categoria',
-                              title="Distribuição de Valores por Categoria")
-            st.plotly_chart(fig_pizza, width='stretch')
+        fig_pizza = px.pie(df_categoria, values='valor_total', names='categoria',
+                          title="Distribuição de Valores por Categoria")
         
-        with col2:
-            fig_barra = px.bar(df_categoria, x='categoria', y='num_atletas',
-                              title="Número de Atletas por Categoria",
-                              labels={'categoria': 'Categoria', 'num_atletas': 'Número de Atletas'})
-            fig_barra.update_xaxes(tickangle=45)
-            st.plotly_chart(fig_barra, width='stretch')
+        fig_barra = px.bar(df_categoria, x='categoria', y='num_atletas',
+                          title="Número de Atletas por Categoria",
+                          labels={'categoria': 'Categoria', 'num_atletas': 'Número de Atletas'})
+        fig_barra.update_xaxes(tickangle=45)
+        
+        st.plotly_chart(side_by_side(fig_pizza, fig_barra), width='stretch', key="cat_combo")
         
         # Tabela detalhada
         st.subheader("📋 Detalhamento")
-        st.dataframe(df_categoria, width='stretch')
+        show_df(df_categoria, key="tab_categoria")
 
 # ========== PÁGINA 3: ANÁLISE POR MODALIDADE ==========
 elif page == "Análise por Modalidade":
     st.header("🏅 Análise por Modalidade")
     
-    # Obter todas as modalidades
-    modalidades = fetch_query('SELECT modalidade FROM modalidade ORDER BY modalidade', conn)['modalidade'].tolist()
+    # Todas as modalidades (já carregadas para os filtros globais)
+    modalidades = filter_options['modalidades']
     
     # Filtros
     modalidade_selecionada = st.selectbox("Selecione uma modalidade:", ["Todas"] + modalidades)
     
-    # Query base
-    if modalidade_selecionada == "Todas":
-        query_modalidade = """
-        SELECT 
-            m.modalidade,
-            COUNT(p.id_pagamento) as num_pagamentos,
-            COUNT(DISTINCT p.cpf) as num_atletas,
-            SUM(p.valor_pago) as valor_total,
-            AVG(p.valor_pago) as valor_medio
-        FROM pagamento p
-        JOIN modalidade m ON p.id_modalidade = m.id_modalidade
-        GROUP BY m.modalidade
-        ORDER BY valor_total DESC
-        """
-    else:
-        query_modalidade = f"""
+    # Agregado de todas as modalidades, em cache, agrupado só pelo id (índice
+    # ix_pag_mod_cov); o nome vem da dimensão pré-carregada e a seleção é um recorte em pandas
+    query_modalidade = f"""
+    SELECT 
+        g.id_modalidade,
+        g.num_pagamentos,
+        s.num_atletas,
+        g.valor_total,
+        g.valor_medio
+    FROM (
         SELECT 
-            m.modalidade,
-            COUNT(p.id_pagamento) as num_pagamentos,
-            COUNT(DISTINCT p.cpf) as num_atletas,
-            SUM(p.valor_pago) as valor_total,
-            AVG(p.valor_pago) as valor_medio
-        FROM pagamento p
-        JOIN modalidade m ON p.id_modalidade = m.id_modalidade
-        WHERE m.modalidade = '{modalidade_selecionada}'
-        GROUP BY m.modalidade
-        """
+            id_modalidade,
+            COUNT(id_pagamento) as num_pagamentos,
+            SUM(valor_pago) as valor_total,
+            AVG(valor_pago) as valor_medio
+        FROM pagamento
+        GROUP BY id_modalidade
+    ) g
+    JOIN {stats_source('_stats_modalidade')} s ON s.id_modalidade = g.id_modalidade
+    ORDER BY valor_total DESC
+    """
     
-    df_modalidade = fetch_query(query_modalidade, conn)
+    df_modalidade = attach_dimension(cached_query(query_modalidade), 'modalidade')
+    if modalidade_selecionada != "Todas":
+        df_modalidade = df_modalidade[df_modalidade['modalidade'] == modalidade_selecionada].reset_index(drop=True)
+        totais = page_totals("FROM pagamento p", "WHERE p.id_modalidade = ?",
+                             (dimension_id('modalidade', modalidade_selecionada),))
+    else:
+        totais = page_totals("FROM pagamento p")
     
     # Métricas
     if not df_modalidade.empty:
         col1, col2, col3, col4 = st.columns(4)
         with col1:
-            st.metric("Pagamentos", f"{df_modalidade['num_pagamentos'].sum():,}")
+            st.metric("Pagamentos", f"{totais['num_pagamentos']:,}")
         with col2:
-            st.metric("Atletas", f"{df_modalidade['num_atletas'].sum():,}")
+            st.metric("Atletas", f"{totais['num_atletas']:,}")
         with col3:
-            st.metric("Valor Total", f"R$ {df_modalidade['valor_total'].sum():,.2f}")
+            st.metric("Valor Total", f"R$ {totais['valor_total']:,.2f}")
         with col4:
-            st.metric("Valor Médio", f"R$ {df_modalidade['valor_medio'].mean():,.2f}")
+            st.metric("Valor Médio", f"R$ {totais['valor_medio']:,.2f}")
         
         st.markdown("---")
         
-        # Gráficos
-        col1, col2 = st.columns(2)
+        # Gráficos: os dois em uma única figura (make_subplots)
         
-        with col1:
-            # Top 20 modalidades
-            df_top20 = df_modalidade.head(20)
-            fig_barra = px.bar(df_top20, x='modalidade', y='valor_total',
-                              title="Top 20 Modalidades por Valor Total",
-                              labels={'modalidade': 'Modalidade', 'valor_total': 'Valor Total (R$)'})
-            fig_barra.update_xaxes(tickangle=45)
-            st.plotly_chart(fig_barra, width='stretch')
+        # Top 20 modalidades: recorte do agregado já carregado, já ordenado por valor total
+        df_top20 = df_modalidade.head(20)
+        fig_barra = px.bar(df_top20, x='modalidade', y='valor_total',
+                          title="Top 20 Modalidades por Valor Total",
+                          labels={'modalidade': 'Modalidade', 'valor_total': 'Valor Total (R$)'})
+        fig_barra.update_xaxes(tickangle=45)
         
-        with col2:
+        titulo_scatter = "Relação: Atletas vs Valor Total"
+        if len(df_modalidade) > WEBGL_MIN_POINTS:
+            # Muitos pontos: WebGL, com bolhas na mesma escala de área do px.scatter
+            fig_scatter = go.Figure(go.Scattergl(
+                x=df_modalidade['num_atletas'], y=df_modalidade['valor_total'],
+                mode='markers', text=df_modalidade['modalidade'],
+                marker=dict(size=df_modalidade['num_pagamentos'], sizemode='area',
+                            # Em float: num_pagamentos pode vir como int16 de compact_dtypes
+                            sizeref=2.0 * float(df_modalidade['num_pagamentos'].max()) / 20 ** 2),
+                hovertemplate="<b>%{text}</b><br>Número de Atletas=%{x}<br>Valor Total (R$)=%{y}<extra></extra>"
+            ))
+            fig_scatter.update_layout(title=titulo_scatter, xaxis_title='Número de Atletas',
+                                      yaxis_title='Valor Total (R$)')
+        else:
             fig_scatter = px.scatter(df_modalidade, x='num_atletas', y='valor_total',
                                     size='num_pagamentos', hover_name='modalidade',
-                                    title="Relação: Atletas vs Valor Total",
+                                    title=titulo_scatter,
                                     labels={'num_atletas': 'Número de Atletas', 
                                            'valor_total': 'Valor Total (R$)'})
-            st.plotly_chart(fig_scatter, width='stretch')
+        
+        st.plotly_chart(side_by_side(fig_barra, fig_scatter), width='stretch', key="mod_combo")
         
         # Tabela detalhada
         st.subheader("📋 Detalhamento")
-        st.dataframe(df_modalidade, width='stretch')
+        show_df(df_modalidade, key="tab_modalidade")
 
 # ========== PÁGINA 4: ANÁLISE POR REGIÃO ==========
 elif page == "Análise por Região":
     st.header("🗺️ Análise por Região")
     
-    # Obter todos os estados
-    estados = fetch_query('SELECT DISTINCT uf FROM municipio ORDER BY uf', conn)['uf'].tolist()
+    # Todos os estados (já carregados para os filtros globais)
+    estados = filter_options['estados']
     
     # Filtros
     estado_selecionado = st.selectbox("Selecione um estado:", ["Todos"] + estados)
     
     # Query base
     if estado_selecionado == "Todos":
-        query_regiao = """
+        params_regiao = ()
+        query_regiao = f"""
         SELECT 
             mu.uf,
-            COUNT(DISTINCT mu.id_municipio) as num_municipios,
-            COUNT(DISTINCT a.cpf) as num_atletas,
+            s.num_municipios,
+            s.num_atletas,
             COUNT(p.id_pagamento) as num_pagamentos,
             SUM(p.valor_pago) as valor_total,
             AVG(p.valor_pago) as valor_medio
         FROM pagamento p
         JOIN atleta a ON p.cpf = a.cpf
         JOIN municipio mu ON a.id_municipio = mu.id_municipio
-        GROUP BY mu.uf
+        JOIN {stats_source('_stats_uf')} s ON s.uf = mu.uf
+        GROUP BY mu.uf, s.num_municipios, s.num_atletas
         ORDER BY valor_total DESC
         """
     else:
-        query_regiao = f"""
+        params_regiao = (estado_selecionado,)
+        query_regiao = """
         SELECT 
             mu.uf,
             mu.municipio,
@@ -926,56 +1020,79 @@ elif page == "Análise por Região":
         FROM pagamento p
         JOIN atleta a ON p.cpf = a.cpf
         JOIN municipio mu ON a.id_municipio = mu.id_municipio
-        WHERE mu.uf = '{estado_selecionado}'
+        WHERE mu.uf = ?
         GROUP BY mu.uf, mu.municipio
         ORDER BY valor_total DESC
         """
     
-    df_regiao = fetch_query(query_regiao, conn)
+    # O SQLite não tem GROUP BY ROLLUP/GROUPING SETS: a linha de total (uf nula)
+    # vem do próprio agregado via UNION ALL. Cada atleta pertence a um único
+    # município, então a soma dos grupos dá os totais exatos
+    if estado_selecionado == "Todos":
+        colunas_total = "SUM(num_municipios), SUM(num_atletas)"
+    else:
+        colunas_total = "NULL, SUM(num_atletas)"
+    query_regiao_total = f"""
+    WITH grupos AS ({query_regiao})
+    SELECT * FROM grupos
+    UNION ALL
+    SELECT 
+        NULL,
+        {colunas_total},
+        SUM(num_pagamentos),
+        COALESCE(SUM(valor_total), 0),
+        COALESCE(SUM(valor_total) / SUM(num_pagamentos), 0)
+    FROM grupos
+    ORDER BY valor_total DESC
+    """
+    
+    df_regiao = cached_query(query_regiao_total, params_regiao)
+    linha_total = df_regiao['uf'].isna()
+    totais = df_regiao[linha_total].to_dict('records')[0]
+    df_regiao = df_regiao[~linha_total].reset_index(drop=True)
+    if estado_selecionado != "Todos":
+        # Só os 20 maiores municípios vão para os gráficos; a tabela usa o resultado completo
+        df_top20_mun = df_regiao.head(20)
     
     # Métricas
     if not df_regiao.empty:
         col1, col2, col3, col4 = st.columns(4)
         with col1:
-            st.metric("Municípios", f"{df_regiao['num_municipios'].sum() if 'num_municipios' in df_regiao.columns else len(df_regiao):,}")
+            st.metric("Municípios", f"{totais['num_municipios'] if 'num_municipios' in df_regiao.columns else len(df_regiao):,}")
         with col2:
-            st.metric("Atletas", f"{df_regiao['num_atletas'].sum():,}")
+            st.metric("Atletas", f"{totais['num_atletas']:,}")
         with col3:
-            st.metric("Valor Total", f"R$ {df_regiao['valor_total'].sum():,.2f}")
+            st.metric("Valor Total", f"R$ {totais['valor_total']:,.2f}")
         with col4:
-            st.metric("Valor Médio", f"R$ {df_regiao['valor_medio'].mean():,.2f}")
+            st.metric("Valor Médio", f"R$ {totais['valor_medio']:,.2f}")
         
         st.markdown("---")
         
-        # Gráficos
-        col1, col2 = st.columns(2)
+        # Gráficos: os dois em uma única figura (make_subplots)
         
-        with col1:
-            if estado_selecionado == "Todos":
-                fig_barra = px.bar(df_regiao, x='uf', y='valor_total',
-                                  title="Valor Total por Estado",
-                                  labels={'uf': 'Estado', 'valor_total': 'Valor Total (R$)'})
-            else:
-                df_top20_mun = df_regiao.head(20)
-                fig_barra = px.bar(df_top20_mun, x='municipio', y='valor_total',
-                                  title=f"Top 20 Municípios em {estado_selecionado}",
-                                  labels={'municipio': 'Município', 'valor_total': 'Valor Total (R$)'})
-            fig_barra.update_xaxes(tickangle=45)
-            st.plotly_chart(fig_barra, width='stretch')
+        if estado_selecionado == "Todos":
+            fig_barra = px.bar(df_regiao, x='uf', y='valor_total',
+                              title="Valor Total por Estado",
+                              labels={'uf': 'Estado', 'valor_total': 'Valor Total (R$)'})
+        else:
+            fig_barra = px.bar(df_top20_mun, x='municipio', y='valor_total',
+                              title=f"Top 20 Municípios em {estado_selecionado}",
+                              labels={'municipio': 'Município', 'valor_total': 'Valor Total (R$)'})
+        fig_barra.update_xaxes(tickangle=45)
         
-        with col2:
-            if estado_selecionado == "Todos":
-                fig_pizza = px.pie(df_regiao, values='num_atletas', names='uf',
-                                  title="Distribuição de Atletas por Estado")
-            else:
-                df_top10_mun = df_regiao.head(10)
-                fig_pizza = px.pie(df_top10_mun, values='num_atletas', names='municipio',
-                                  title=f"Top 10 Municípios em {estado_selecionado}")
-            st.plotly_chart(fig_pizza, width='stretch')
+        if estado_selecionado == "Todos":
+            fig_pizza = px.pie(df_regiao, values='num_atletas', names='uf',
+                              title="Distribuição de Atletas por Estado")
+        else:
+            df_top10_mun = df_top20_mun.head(10)
+            fig_pizza = px.pie(df_top10_mun, values='num_atletas', names='municipio',
+                              title=f"Top 10 Municípios em {estado_selecionado}")
+        
+        st.plotly_chart(side_by_side(fig_barra, fig_pizza), width='stretch', key="reg_combo")
         
         # Tabela detalhada
         st.subheader("📋 Detalhamento")
-        st.dataframe(df_regiao, width='stretch')
+        show_df(df_regiao, key="tab_regiao")
 
 # ========== PÁGINA 5: ANÁLISE TEMPORAL ==========
 elif page == "Análise Temporal":
@@ -989,14 +1106,15 @@ elif page == "Análise Temporal":
         metrica = st.selectbox("Métrica:", ["Quantidade de Pagamentos", "Valor Total"])
     
     # Query base
+    # Recortes do ano-mês indexado, em vez de strftime linha a linha
     if tipo_agrupamento == "Ano":
-        formato_data = "strftime('%Y', data_pagamento)"
+        formato_data = f"substr({ANO_MES_EXPR}, 1, 4)"
         label_data = "ano"
     elif tipo_agrupamento == "Mês":
-        formato_data = "strftime('%m', data_pagamento)"
+        formato_data = f"substr({ANO_MES_EXPR}, 6, 2)"
         label_data = "mes"
     else:
-        formato_data = "strftime('%Y-%m', data_pagamento)"
+        formato_data = ANO_MES_EXPR
         label_data = "ano_mes"
     
     if metrica == "Quantidade de Pagamentos":
@@ -1012,33 +1130,41 @@ elif page == "Análise Temporal":
         AVG(valor_pago) as valor_medio,
         COUNT(DISTINCT cpf) as num_atletas
     FROM pagamento
-    WHERE data_pagamento IS NOT NULL
+    WHERE {ANO_MES_EXPR} IS NOT NULL
     GROUP BY periodo
     ORDER BY periodo
     """
     
-    df_temporal = fetch_query(query_temporal, conn)
+    df_temporal = cached_query(query_temporal)
+    totais = page_totals("FROM pagamento p", "WHERE p.data_pagamento IS NOT NULL")
     
     if not df_temporal.empty:
         # Gráfico de linha temporal
         campo_grafico = 'valor_total' if metrica == "Valor Total" else 'num_pagamentos'
         titulo_grafico = f"Evolução {metrica} ao Longo do Tempo"
         
-        fig_temporal = px.line(df_temporal, x='periodo', y=campo_grafico,
-                              title=titulo_grafico,
-                              labels={'periodo': 'Período', campo_grafico: metrica})
-        st.plotly_chart(fig_temporal, width='stretch')
+        if len(df_temporal) > WEBGL_MIN_POINTS:
+            # Séries longas são desenhadas via WebGL em vez de SVG
+            df_linha = downsample_series(df_temporal, campo_grafico)
+            fig_temporal = go.Figure(go.Scattergl(x=df_linha['periodo'], y=df_linha[campo_grafico],
+                                                  mode='lines'))
+            fig_temporal.update_layout(title=titulo_grafico, xaxis_title='Período', yaxis_title=metrica)
+        else:
+            fig_temporal = px.line(df_temporal, x='periodo', y=campo_grafico,
+                                  title=titulo_grafico,
+                                  labels={'periodo': 'Período', campo_grafico: metrica})
+        st.plotly_chart(fig_temporal, width='stretch', key="temporal_linha")
         
         # Métricas
         col1, col2, col3, col4 = st.columns(4)
         with col1:
             st.metric("Total de Períodos", len(df_temporal))
         with col2:
-            st.metric("Total de Pagamentos", f"{df_temporal['num_pagamentos'].sum():,}")
+            st.metric("Total de Pagamentos", f"{totais['num_pagamentos']:,}")
         with col3:
-            st.metric("Valor Total", f"R$ {df_temporal['valor_total'].sum():,.2f}")
+            st.metric("Valor Total", f"R$ {totais['valor_total']:,.2f}")
         with col4:
-            st.metric("Valor Médio", f"R$ {df_temporal['valor_medio'].mean():,.2f}")
+            st.metric("Valor Médio", f"R$ {totais['valor_medio']:,.2f}")
         
         st.markdown("---")
         
@@ -1047,72 +1173,103 @@ elif page == "Análise Temporal":
                            title=f"{metrica} por Período",
                            labels={'periodo': 'Período', campo_grafico: metrica})
         fig_barras.update_xaxes(tickangle=45)
-        st.plotly_chart(fig_barras, width='stretch')
+        st.plotly_chart(fig_barras, width='stretch', key="temporal_barras")
         
         # Tabela detalhada
         st.subheader("📋 Detalhamento")
-        st.dataframe(df_temporal, width='stretch')
+        show_df(df_temporal, key="tab_temporal")
 
 # ========== PÁGINA 6: BUSCA DE ATLETAS ==========
 elif page == "Busca de Atletas":
     st.header("🔍 Busca de Atletas")
     
-    # Campo de busca
-    busca = st.text_input("Digite o nome do atleta (ou parte do nome):", "")
-    
-    if busca:
-        query_busca = f"""
+    # Campo de busca dentro de um formulário: o valor só é enviado ao clicar
+    # em Buscar, e não a cada tecla digitada
+    with st.form("busca_form"):
+        busca = st.text_input("Digite o nome do atleta (ou parte do nome):", "")
+        st.form_submit_button("Buscar")
+    busca = busca.strip()
+    
+    if busca and len(busca) < BUSCA_MIN_CHARS:
+        st.info(f"Digite pelo menos {BUSCA_MIN_CHARS} caracteres para buscar.")
+    elif busca:
+        # Com o índice FTS, o filtro por nome percorre só as postagens do termo
+        if prepare_database()['fts']:
+            filtro_nome = "a.rowid IN (SELECT rowid FROM atleta_fts WHERE nome LIKE ?)"
+        else:
+            filtro_nome = "a.nome LIKE ?"
+        
+        # Fase 1: atletas cujo nome contém o termo
+        query_atletas = f"""
         SELECT 
             a.nome,
             a.cpf,
             mu.municipio,
-            mu.uf,
-            COUNT(p.id_pagamento) as num_pagamentos,
-            SUM(p.valor_pago) as valor_total,
-            AVG(p.valor_pago) as valor_medio,
-            MIN(p.data_pagamento) as primeira_data,
-            MAX(p.data_pagamento) as ultima_data
+            mu.uf
         FROM atleta a
         JOIN municipio mu ON a.id_municipio = mu.id_municipio
-        LEFT JOIN pagamento p ON a.cpf = p.cpf
-        WHERE a.nome LIKE '%{busca}%'
-        GROUP BY a.cpf, a.nome, mu.municipio, mu.uf
-        ORDER BY valor_total DESC
-        LIMIT 100
+        WHERE {filtro_nome}
         """
         
-        df_busca = fetch_query(query_busca, conn)
+        df_busca = cached_query(query_atletas, (f"%{busca}%",))
+        
+        # Fase 2: agregado dos pagamentos só dos CPFs encontrados (ix_pag_cpf),
+        # em vez de um GROUP BY sobre o JOIN com toda a tabela pagamento; o
+        # filtro é repetido como subconsulta para usar um único parâmetro
+        if not df_busca.empty:
+            query_pagamentos = f"""
+            SELECT 
+                cpf,
+                COUNT(*) as num_pagamentos,
+                SUM(valor_pago) as valor_total,
+                AVG(valor_pago) as valor_medio,
+                MIN(data_pagamento) as primeira_data,
+                MAX(data_pagamento) as ultima_data
+            FROM pagamento
+            WHERE cpf IN (SELECT a.cpf FROM atleta a WHERE {filtro_nome})
+            GROUP BY cpf
+            """
+            
+            df_pagamentos = cached_query(query_pagamentos, (f"%{busca}%",))
+            # Atletas sem pagamento ficam com 0 pagamentos e valores nulos, no fim da lista
+            df_busca = df_busca.merge(df_pagamentos, on='cpf', how='left')
+            df_busca['num_pagamentos'] = df_busca['num_pagamentos'].fillna(0).astype('int64')
+            df_busca = (df_busca.sort_values('valor_total', ascending=False, kind='stable')
+                        .head(BUSCA_MAX_RESULTS)
+                        .reset_index(drop=True))
         
         if not df_busca.empty:
             st.success(f"Encontrados {len(df_busca)} atleta(s)")
             
+            # Mapa nome -> cpf; com nomes repetidos vale a primeira linha
+            # (maior valor total), como no filtro original
+            nome_to_cpf = dict(zip(df_busca['nome'][::-1], df_busca['cpf'][::-1]))
+            
             # Selecionar atleta para detalhamento
             atleta_selecionado = st.selectbox("Selecione um atleta para ver detalhes:",
                                              df_busca['nome'].tolist())
             
             if atleta_selecionado:
-                cpf_atleta = df_busca[df_busca['nome'] == atleta_selecionado]['cpf'].iloc[0]
+                cpf_atleta = nome_to_cpf[atleta_selecionado]
                 
                 # Detalhes do atleta
-                query_detalhes = f"""
+                query_detalhes = """
                 SELECT 
                     p.data_pagamento,
                     p.data_referencia,
-                    c.categoria,
-                    m.modalidade,
-                    s.situacao,
+                    p.id_categoria,
+                    p.id_modalidade,
+                    p.id_situacao,
                     p.valor_pago,
-                    e.id_edital as edital
+                    p.id_edital as edital
                 FROM pagamento p
-                JOIN categoria c ON p.id_categoria = c.id_categoria
-                JOIN modalidade m ON p.id_modalidade = m.id_modalidade
-                JOIN situacao s ON p.id_situacao = s.id_situacao
-                JOIN edital e ON p.id_edital = e.id_edital
-                WHERE p.cpf = '{cpf_atleta}'
+                WHERE p.cpf = ?
                 ORDER BY p.data_pagamento DESC
                 """
                 
-                df_detalhes = fetch_query(query_detalhes, conn)
+                # Nomes de categoria, modalidade e situação vêm das dimensões em cache
+                df_detalhes = attach_dimension(cached_query(query_detalhes, (cpf_atleta,)),
+                                               'categoria', 'modalidade', 'situacao')
                 
                 st.subheader(f"Detalhes de {atleta_selecionado}")
                 
@@ -1124,7 +1281,7 @@ elif page == "Busca de Atletas":
                 with col3:
                     st.metric("Valor Médio", f"R$ {df_detalhes['valor_pago'].mean():,.2f}")
                 
-                st.dataframe(df_detalhes, width='stretch')
+                show_df(df_detalhes, key="tab_detalhes")
         else:
             st.warning("Nenhum atleta encontrado com esse nome.")
     else:
@@ -1141,9 +1298,15 @@ elif page == "Dados Brutos":
     # Número de linhas
     num_linhas = st.slider("Número de linhas:", 10, 1000, 100)
     
-    # Query
-    query_dados = f"SELECT * FROM {tabela_selecionada} LIMIT {num_linhas}"
-    df_dados = fetch_query(query_dados, conn)
+    # O nome da tabela entra no SQL como texto: só nomes da lista são aceitos
+    if tabela_selecionada not in tabelas:
+        st.error(f"Tabela inválida: {tabela_selecionada}")
+        st.stop()
+    
+    # Query com as colunas explícitas do esquema
+    colunas = ', '.join(f'"{col}"' for col in table_columns(tabela_selecionada))
+    query_dados = f"SELECT {colunas} FROM {tabela_selecionada} LIMIT ?"
+    df_dados = cached_query(query_dados, (num_linhas,))
     
     st.subheader(f"Dados da tabela: {tabela_selecionada}")
     st.dataframe(df_dados, width='stretch')
@@ -1153,6 +1316,9 @@ elif page == "Dados Brutos":
     st.write(f"Total de linhas exibidas: {len(df_dados)}")
     st.write(f"Total de colunas: {len(df_dados.columns)}")
 
-# Nota: A conexão é gerenciada automaticamente pelo @st.cache_resource
-# Não precisamos fechá-la manualmente
+# Nota: a conexão somente leitura (get_valid_connection) vale para uma única
+# execução do script. Cada rerun roda em uma thread nova, que abre outra
+# conexão e refaz CONNECTION_SETUP_SQL e as tabelas temporárias f_*; a
+# anterior é fechada quando o armazenamento da thread encerrada é coletado
+# (ou antes, por close_connection, se uma consulta falha)
 
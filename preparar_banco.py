@@ -0,0 +1,176 @@
+"""Preparação do banco bolsa_atleta.db para o dashboard
+
+Cria os índices, as tabelas auxiliares e o índice de busca usados pelas
+páginas do app. O app chama prepare() na inicialização, que só escreve no
+arquivo quando falta algo ou quando os dados de origem mudaram. Após
+recarregar os dados, execute uma vez:
+
+    python preparar_banco.py [--rebuild] [--wal]
+"""
+import argparse
+import sqlite3
+from contextlib import closing
+from pathlib import Path
+
+# Caminho padrão do banco de dados
+DB_PATH = Path('bolsa_atleta.db')
+
+# Ano-mês (AAAA-MM) de data_pagamento, guardada como texto ISO; a mesma
+# expressão indexa o agrupamento da página temporal
+ANO_MES_EXPR = "substr(data_pagamento, 1, 7)"
+
+# Índices sobre as colunas de JOIN e filtro usadas pelas páginas; os de
+# categoria e modalidade incluem cpf e valor_pago para que os agregados
+# dessas páginas sejam respondidos só pelo índice
+INDEXES = {
+    'ix_pag_cat_cov': "pagamento(id_categoria, cpf, valor_pago)",
+    'ix_pag_mod_cov': "pagamento(id_modalidade, cpf, valor_pago)",
+    'ix_pag_cpf': "pagamento(cpf)",
+    'ix_pag_data': "pagamento(data_pagamento)",
+    'ix_pag_valor': "pagamento(valor_pago)",
+    'ix_pag_ano_mes': f"pagamento({ANO_MES_EXPR}, cpf, valor_pago)",
+    'ix_atl_mun': "atleta(id_municipio)",
+    'ix_mun_uf': "municipio(uf)",
+}
+
+# Número de atletas distintos por grupo, para que as páginas não refaçam
+# COUNT(DISTINCT cpf) a cada consulta: esquema e consulta de preenchimento.
+# A consulta também serve de subconsulta substituta quando a tabela não
+# pode ser criada (banco somente leitura)
+STATS_TABLES = {
+    '_stats_categoria': (
+        "id_categoria INTEGER PRIMARY KEY, num_atletas INTEGER NOT NULL",
+        """SELECT id_categoria, COUNT(DISTINCT cpf) as num_atletas
+        FROM pagamento GROUP BY id_categoria"""
+    ),
+    '_stats_modalidade': (
+        "id_modalidade INTEGER PRIMARY KEY, num_atletas INTEGER NOT NULL",
+        """SELECT id_modalidade, COUNT(DISTINCT cpf) as num_atletas
+        FROM pagamento GROUP BY id_modalidade"""
+    ),
+    '_stats_uf': (
+        "uf TEXT PRIMARY KEY, num_municipios INTEGER NOT NULL, num_atletas INTEGER NOT NULL",
+        """SELECT mu.uf, COUNT(DISTINCT mu.id_municipio) as num_municipios, COUNT(DISTINCT a.cpf) as num_atletas
+        FROM pagamento p
+        JOIN atleta a ON p.cpf = a.cpf
+        JOIN municipio mu ON a.id_municipio = mu.id_municipio
+        GROUP BY mu.uf"""
+    ),
+}
+
+# Assinatura dos dados de origem das estatísticas; quando muda, as tabelas
+# _stats_* são reconstruídas
+STATS_SOURCE_SQL = """
+SELECT (SELECT COUNT(*) FROM pagamento) || ':' ||
+       (SELECT IFNULL(MAX(id_pagamento), 0) FROM pagamento) || ':' ||
+       (SELECT COUNT(*) FROM atleta)
+"""
+
+# Índice de texto completo sobre atleta.nome para a página de busca. O
+# tokenizador trigram atende LIKE '%termo%' pelo índice, mantendo a mesma
+# semântica de substring da busca original
+ATHLETE_FTS_SQL = """
+CREATE VIRTUAL TABLE IF NOT EXISTS atleta_fts USING fts5(
+    nome, content='atleta', content_rowid='rowid', tokenize='trigram'
+);
+INSERT INTO atleta_fts(atleta_fts) VALUES('rebuild');
+"""
+
+# Assinatura da tabela atleta; quando muda, o índice de busca é reconstruído
+ATHLETE_SOURCE_SQL = """
+SELECT (SELECT COUNT(*) FROM atleta) || ':' || (SELECT IFNULL(MAX(rowid), 0) FROM atleta)
+"""
+
+# Registro das assinaturas com que cada objeto derivado foi construído
+PREPARO_SQL = "CREATE TABLE IF NOT EXISTS _preparo (objeto TEXT PRIMARY KEY, assinatura TEXT NOT NULL)"
+
+
+# Função para listar o que falta preparar no banco
+def pending_objects(conn: sqlite3.Connection) -> set:
+    """Retorna os índices ausentes e os marcadores 'stats' e 'atleta_fts' dos objetos ausentes ou desatualizados"""
+    existing = {row[0] for row in conn.execute("SELECT name FROM sqlite_master")}
+    pending = {name for name in INDEXES if name not in existing}
+
+    built = {}
+    if '_preparo' in existing:
+        built = dict(conn.execute("SELECT objeto, assinatura FROM _preparo"))
+    if (any(name not in existing for name in STATS_TABLES)
+            or built.get('stats') != conn.execute(STATS_SOURCE_SQL).fetchone()[0]):
+        pending.add('stats')
+    if ('atleta_fts' not in existing
+            or built.get('atleta_fts') != conn.execute(ATHLETE_SOURCE_SQL).fetchone()[0]):
+        pending.add('atleta_fts')
+    return pending
+
+
+# Função para (re)construir as tabelas de estatísticas
+def build_stats(conn: sqlite3.Connection):
+    """Recria as tabelas _stats_* a partir dos dados atuais e grava a assinatura de origem"""
+    with conn:
+        conn.execute(PREPARO_SQL)
+        for name, (columns, fill_query) in STATS_TABLES.items():
+            conn.execute(f"DROP TABLE IF EXISTS {name}")
+            conn.execute(f"CREATE TABLE {name} ({columns})")
+            conn.execute(f"INSERT INTO {name} {fill_query}")
+        conn.execute("INSERT OR REPLACE INTO _preparo VALUES ('stats', (" + STATS_SOURCE_SQL + "))")
+
+
+# Função para (re)construir o índice de busca por nome
+def build_athlete_fts(conn: sqlite3.Connection) -> bool:
+    """Cria o índice FTS5 se falta e o sincroniza com atleta; retorna False se o SQLite não tem FTS5/trigram"""
+    try:
+        conn.executescript(ATHLETE_FTS_SQL)
+    except sqlite3.OperationalError:
+        conn.rollback()
+        return False
+    with conn:
+        conn.execute(PREPARO_SQL)
+        conn.execute("INSERT OR REPLACE INTO _preparo VALUES ('atleta_fts', (" + ATHLETE_SOURCE_SQL + "))")
+    return True
+
+
+# Função para preparar o banco
+def prepare(conn: sqlite3.Connection, rebuild: bool = False) -> bool:
+    """Cria só os objetos pendentes (ou todos, com rebuild) e retorna se algo foi escrito"""
+    pending = pending_objects(conn)
+    if rebuild:
+        pending |= {'stats', 'atleta_fts'}
+
+    changed = False
+    for name, target in INDEXES.items():
+        if name in pending:
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {target}")
+            changed = True
+    if 'stats' in pending:
+        build_stats(conn)
+        changed = True
+    # Sem suporte a FTS5 o índice de busca continua pendente, sem escrita
+    if 'atleta_fts' in pending and build_athlete_fts(conn):
+        changed = True
+    if changed:
+        conn.execute("ANALYZE")
+        conn.commit()
+    return changed
+
+
+# Execução manual, como etapa única após carregar ou recarregar os dados
+def main():
+    parser = argparse.ArgumentParser(description="Prepara o banco do dashboard Bolsa Atleta")
+    parser.add_argument('db', nargs='?', default=str(DB_PATH), help="caminho do banco SQLite")
+    parser.add_argument('--rebuild', action='store_true',
+                        help="reconstrói as tabelas derivadas mesmo que pareçam atualizadas")
+    parser.add_argument('--wal', action='store_true',
+                        help="muda o arquivo para o modo WAL (leitores simultâneos sem bloqueio)")
+    args = parser.parse_args()
+
+    with closing(sqlite3.connect(args.db, timeout=30)) as conn:
+        # WAL é uma propriedade permanente do arquivo e cria os arquivos
+        # -wal/-shm ao lado dele; por isso só é ativado a pedido
+        if args.wal:
+            conn.execute("PRAGMA journal_mode = WAL")
+        changed = prepare(conn, rebuild=args.rebuild) or args.wal
+    print("Banco preparado." if changed else "Nada a fazer: o banco já está preparado.")
+
+
+if __name__ == '__main__':
+    main()